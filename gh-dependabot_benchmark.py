@@ -0,0 +1,405 @@
+#!/usr/bin/env python3
+
+import os
+import re
+import sys
+import json
+import time
+import tempfile
+import threading
+import contextlib
+import tracemalloc
+import subprocess
+import urllib.request
+import importlib.util
+import importlib.machinery
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+
+def import_path(path):
+    module_name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
+    spec = importlib.util.spec_from_loader(
+        module_name,
+        importlib.machinery.SourceFileLoader(module_name, path)
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    sys.modules[module_name] = module
+    return module
+
+
+dependabot = import_path(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'gh-dependabot'))
+
+BENCHMARK_ORG = 'benchmark'
+SEVERITIES = ['LOW', 'MODERATE', 'HIGH', 'CRITICAL']
+ECOSYSTEMS = ['PIP', 'NPM', 'MAVEN', 'RUBYGEMS']
+GRAPHQL_MAX_PAGE_SIZE = 100
+RATE_LIMIT_WINDOW = 3600
+
+page_size_regex = re.compile(r'(?:first|last): (\d+)')
+
+
+class FakeGitHub():
+    """
+        Answers API requests for an organization with the configured number of repositories and alerts
+
+        Every Nth request can be answered with a primary or secondary rate limit 403
+        instead, and every response is held back by the configured latency.
+    """
+
+    def __init__(self, repos, alerts, latency, primary_limit_every, secondary_limit_every, quota):
+        self.repos = repos
+        self.alerts = alerts
+        self.latency = latency
+        self.primary_limit_every = primary_limit_every
+        self.secondary_limit_every = secondary_limit_every
+        self.quota = quota
+        self.reset = int(time.time()) + RATE_LIMIT_WINDOW
+        self.remaining = {}
+        self.lock = threading.Lock()
+        self.request_count = 0
+        self.stats = self.empty_stats()
+
+    def empty_stats(self):
+        return { 'requests': 0, 'graphql': 0, 'reads': 0, 'writes': 0, 'rate_limited': 0, 'bytes': 0 }
+
+    def get_stats(self):
+        """Returns the counters since the last call and starts counting again"""
+        with self.lock:
+            stats, self.stats = self.stats, self.empty_stats()
+        return stats
+
+    def handle(self, method, path, payload):
+        time.sleep(self.latency)
+        resource = 'graphql' if path == '/graphql' else 'core'
+
+        with self.lock:
+            self.request_count += 1
+            count = self.request_count
+            self.stats['requests'] += 1
+            if resource == 'graphql':
+                self.stats['graphql'] += 1
+            elif method == 'GET':
+                self.stats['reads'] += 1
+            else:
+                self.stats['writes'] += 1
+
+            if self.primary_limit_every and count % self.primary_limit_every == 0:
+                self.stats['rate_limited'] += 1
+                headers = self.get_rate_limit_headers(resource, 0, int(time.time()) + 1)
+                return (403, headers, { 'message': 'API rate limit exceeded' })
+
+            if self.secondary_limit_every and count % self.secondary_limit_every == 0:
+                self.stats['rate_limited'] += 1
+                headers = { 'Retry-After': '1' }
+                return (403, headers, { 'message': 'You have exceeded a secondary rate limit' })
+
+            remaining = max(self.remaining.get(resource, self.quota) - 1, 0)
+            self.remaining[resource] = remaining
+            headers = self.get_rate_limit_headers(resource, remaining, self.reset)
+
+        if path == '/graphql':
+            return (200, headers, self.graphql(payload['query'], payload.get('variables', {})))
+
+        match = re.fullmatch(r'/repos/[^/]+/[^/]+/(vulnerability-alerts|automated-security-fixes)', path)
+        if match is None:
+            return (404, headers, { 'message': 'Not Found' })
+        if method == 'GET' and match.group(1) == 'automated-security-fixes':
+            return (200, headers, { 'enabled': False, 'paused': False })
+        if method == 'PUT':
+            return (204, headers, None)
+
+        return (404, headers, { 'message': 'Not Found' })
+
+    def get_rate_limit_headers(self, resource, remaining, reset):
+        return {
+            'X-RateLimit-Limit': str(self.quota),
+            'X-RateLimit-Remaining': str(remaining),
+            'X-RateLimit-Reset': str(reset),
+            'X-RateLimit-Resource': resource,
+        }
+
+    def graphql(self, query, variables):
+        if 'organization(login:' in query:
+            return { 'data': { 'organization': self.list_repositories(variables.get('cursor')) } }
+
+        aliases = sorted(int(key[len('name'):]) for key in variables if key.startswith('name'))
+        if 'hasVulnerabilityAlertsEnabled' in query:
+            return { 'data': { "repo%i" % index: { 'hasVulnerabilityAlertsEnabled': False } for index in aliases } }
+
+        page_size = min(int(page_size_regex.search(query).group(1)), GRAPHQL_MAX_PAGE_SIZE)
+        newest_first = 'last: ' in query
+        data = {}
+        for index in aliases:
+            repo_index = int(variables["name%i" % index].rpartition('-')[2])
+            cursor = variables.get("cursor%i" % index)
+            data["repo%i" % index] = {
+                'isArchived': False,
+                'vulnerabilityAlerts': self.list_alerts(repo_index, cursor, page_size, newest_first),
+            }
+
+        return { 'data': data }
+
+    def list_repositories(self, cursor):
+        start = int(cursor) if cursor else 0
+        end = min(start + 100, self.repos)
+        nodes = [
+            {
+                'nameWithOwner': "%s/repo-%05i" % (BENCHMARK_ORG, index),
+                'isArchived': False,
+                'visibility': 'PRIVATE',
+                'languages': { 'nodes': [] },
+                'repositoryTopics': { 'nodes': [] },
+            }
+            for index in range(start, end)
+        ]
+        return { 'repositories': { 'pageInfo': { 'hasNextPage': end < self.repos, 'endCursor': str(end) }, 'nodes': nodes } }
+
+    def list_alerts(self, repo_index, cursor, page_size, newest_first):
+        # Cursors are just the offset of the alert they point at
+        if newest_first:
+            end = int(cursor) if cursor else self.alerts
+            start = max(end - page_size, 0)
+        else:
+            start = int(cursor) if cursor else 0
+            end = min(start + page_size, self.alerts)
+
+        return {
+            'pageInfo': {
+                'hasNextPage': end < self.alerts,
+                'endCursor': str(end),
+                'hasPreviousPage': start > 0,
+                'startCursor': str(start),
+            },
+            'totalCount': self.alerts,
+            'nodes': [ self.get_alert(repo_index, index) for index in range(start, end) ],
+        }
+
+    def get_alert(self, repo_index, index):
+        return {
+            'id': "RVA_%i_%i" % (repo_index, index),
+            'securityAdvisory': {
+                'ghsaId': "GHSA-%04i-%04i" % (repo_index, index),
+                'permalink': "https://github.com/advisories/GHSA-%04i-%04i" % (repo_index, index),
+                'severity': SEVERITIES[index % len(SEVERITIES)],
+                'description': 'A vulnerability in a benchmark package. ' * 10,
+                'summary': "Benchmark vulnerability %i" % index,
+            },
+            'securityVulnerability': {
+                'package': { 'name': "package-%i" % (index % 50), 'ecosystem': ECOSYSTEMS[index % len(ECOSYSTEMS)] },
+                'vulnerableVersionRange': '< 1.0.%i' % index,
+                'advisory': { 'cvss': { 'score': round(index % 100 / 10, 1) } },
+            },
+            'createdAt': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime(1640995200 + index * 3600)),
+            'state': 'OPEN' if index % 3 else 'FIXED',
+            'fixedAt': None,
+            'fixReason': None,
+            'dismissedAt': None,
+            'dismissReason': None,
+            'dismisser': None,
+            'autoDismissedAt': None,
+            'vulnerableManifestPath': 'requirements.txt',
+            'vulnerableRequirements': '= 0.%i' % index,
+        }
+
+
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def do_PUT(self):
+        self.respond()
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length)) if length else None
+
+        if self.path == '/_benchmark/stats':
+            status, headers, body = (200, {}, self.server.github.get_stats())
+        else:
+            status, headers, body = self.server.github.handle(self.command, self.path, payload)
+
+        data = json.dumps(body).encode('utf-8') if body is not None else b''
+        with self.server.github.lock:
+            self.server.github.stats['bytes'] += len(data)
+
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(settings):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGitHubHandler)
+    server.github = FakeGitHub(**settings)
+    click.echo(server.server_address[1])
+    sys.stdout.flush()
+    server.serve_forever()
+
+def start_server(settings):
+    """Runs the fake GitHub API in its own process so it doesn't show up in the client's timings or memory"""
+    process = subprocess.Popen([sys.executable, os.path.abspath(__file__), '--serve', json.dumps(settings)], stdout=subprocess.PIPE, text=True)
+    port = process.stdout.readline().strip()
+    if not port:
+        process.wait()
+        process.stdout.close()
+        raise click.ClickException("Could not start the fake GitHub API")
+    return process, 'http://127.0.0.1:%s' % port
+
+def stop_server(process):
+    process.terminate()
+    process.wait()
+    process.stdout.close()
+
+def get_server_stats(server_url):
+    with urllib.request.urlopen(server_url + '/_benchmark/stats') as response:
+        return json.loads(response.read())
+
+@contextlib.contextmanager
+def benchmark_client(server_url, sleep_scale):
+    """
+        Points the extension at the fake server with a fresh rate limiter for one run
+
+        Yields a dict that adds up how long requests actually waited on the limiter
+        and slept on rate limits. Every sleep is scaled by sleep_scale, and so are
+        these totals.
+    """
+    waits = { 'limiter_wait': 0.0, 'rate_limit_sleep': 0.0 }
+    lock = threading.Lock()
+    limiter = dependabot.AdaptiveRateLimiter()
+    acquire, pause = limiter.acquire, limiter.pause
+
+    def timed_acquire(resource='core', write=False):
+        start = time.perf_counter()
+        wait = acquire(resource, write)
+        with lock:
+            waits['limiter_wait'] += time.perf_counter() - start
+        return wait
+
+    def timed_pause(seconds, resource=None):
+        # call_gh_api sleeps for as long as it pauses the limiter
+        with lock:
+            waits['rate_limit_sleep'] += seconds * sleep_scale
+        pause(seconds, resource)
+
+    limiter.acquire, limiter.pause = timed_acquire, timed_pause
+
+    real_sleep = time.sleep
+    original_limiter, original_create_transport = dependabot.limiter, dependabot.create_transport
+    dependabot.limiter = limiter
+    dependabot.create_transport = lambda name: dependabot.HttpTransport('benchmark', server_url)
+    time.sleep = lambda seconds: real_sleep(seconds * sleep_scale)
+    try:
+        yield waits
+    finally:
+        if dependabot.transport is not None:
+            dependabot.transport.close()
+            dependabot.transport = None
+        time.sleep = real_sleep
+        dependabot.limiter, dependabot.create_transport = original_limiter, original_create_transport
+
+def run_command(name, args, server_url, sleep_scale, memory):
+    """Runs one gh-dependabot command end to end against the fake server and measures it"""
+    with benchmark_client(server_url, sleep_scale) as waits, open(os.devnull, 'w') as devnull:
+        if memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(devnull), contextlib.redirect_stderr(devnull):
+            dependabot.dependabot.main(args, prog_name='gh dependabot', standalone_mode=False)
+        wall_time = time.perf_counter() - start
+        peak_memory = tracemalloc.get_traced_memory()[1] if memory else None
+        if memory:
+            tracemalloc.stop()
+
+    result = { 'command': name, 'wall_time': wall_time, 'peak_memory': peak_memory }
+    result.update(waits)
+    result.update(get_server_stats(server_url))
+    result['requests_per_second'] = result['requests'] / wall_time if wall_time else 0.0
+    return result
+
+def format_result(result):
+    peak_memory = '%.1f MiB' % (result['peak_memory'] / 1024 / 1024) if result['peak_memory'] is not None else '-'
+    return "%-8s %8i %8i %6i %6i %5i %9.2fs %8.1f %12.2fs %12.2fs %11s" % (
+        result['command'], result['requests'], result['graphql'], result['reads'], result['writes'], result['rate_limited'],
+        result['wall_time'], result['requests_per_second'], result['limiter_wait'], result['rate_limit_sleep'], peak_memory
+    )
+
+@click.command()
+@click.option('--repos', type=click.IntRange(1), default=20, show_default=True, help='Number of repositories in the fake organization')
+@click.option('--alerts', type=click.IntRange(0), default=50, show_default=True, help='Number of alerts in every repository')
+@click.option('--page-size', type=click.IntRange(1, GRAPHQL_MAX_PAGE_SIZE), default=dependabot.ALERTS_PAGE_SIZE, show_default=True, help='Number of alerts to ask for per repository and page')
+@click.option('-b', '--batch-size', type=click.IntRange(1), default=dependabot.DEFAULT_BATCH_SIZE, show_default=True, help='Passed on to export')
+@click.option('-w', '--workers', type=click.IntRange(1, dependabot.MAX_WORKERS), default=dependabot.DEFAULT_WORKERS, show_default=True, help='Passed on to export and enable')
+@click.option('--latency', type=click.FloatRange(0), default=50, show_default=True, help='Milliseconds the fake server takes to answer every request')
+@click.option('--primary-limit-every', type=click.IntRange(0), default=0, show_default=True, help='Answer every Nth request with a primary rate limit 403 (0 for never)')
+@click.option('--secondary-limit-every', type=click.IntRange(0), default=0, show_default=True, help='Answer every Nth request with a secondary rate limit 403 (0 for never)')
+@click.option('--quota', type=click.IntRange(1), default=5000, show_default=True, help='Rate limit budget per hour of the fake server')
+@click.option('--sleep-scale', type=click.FloatRange(0), default=1.0, show_default=True, help='Scale every client side sleep by this, e.g. 0 to not actually wait on rate limits')
+@click.option('--memory/--no-memory', default=True, show_default=True, help='Track peak memory with tracemalloc, which slows the client down')
+@click.option('--json', 'as_json', is_flag=True, help='Print one JSON object per command instead of a table')
+@click.option('--serve', 'serve_settings', hidden=True, help='Only run the fake server with these JSON settings and print its port')
+@click.argument('commands', nargs=-1, type=click.Choice(['export', 'enable']))
+def benchmark(repos, alerts, page_size, batch_size, workers, latency, primary_limit_every, secondary_limit_every, quota, sleep_scale, memory, as_json, serve_settings, commands):
+    """Runs gh-dependabot commands end to end against a local fake GitHub API and reports how they performed"""
+    if serve_settings:
+        serve(json.loads(serve_settings))
+        return
+
+    settings = {
+        'repos': repos,
+        'alerts': alerts,
+        'latency': latency / 1000,
+        'primary_limit_every': primary_limit_every,
+        'secondary_limit_every': secondary_limit_every,
+        'quota': quota,
+    }
+    process, server_url = start_server(settings)
+    original_page_size = dependabot.ALERTS_PAGE_SIZE
+    dependabot.ALERTS_PAGE_SIZE = page_size
+
+    results = []
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            for command in commands or ('export', 'enable'):
+                if command == 'export':
+                    output = os.path.join(directory, 'alerts.csv')
+                    args = [ 'export', '--org', BENCHMARK_ORG, '-o', output, '-b', str(batch_size), '-w', str(workers) ]
+                else:
+                    args = [ 'enable', '-a', '-s', '--org', BENCHMARK_ORG, '-w', str(workers) ]
+
+                result = run_command(command, args, server_url, sleep_scale, memory)
+                if command == 'export':
+                    with open(output) as output_file:
+                        result['alerts'] = sum(1 for _ in output_file) - 1
+                results.append(result)
+    finally:
+        dependabot.ALERTS_PAGE_SIZE = original_page_size
+        stop_server(process)
+
+    if as_json:
+        for result in results:
+            click.echo(json.dumps(result))
+        return
+
+    click.echo("%i repositories with %i alerts each, %i alerts per page, %gms latency" % (repos, alerts, page_size, latency))
+    click.echo("%-8s %8s %8s %6s %6s %5s %10s %8s %13s %13s %11s" % (
+        'command', 'requests', 'graphql', 'reads', 'writes', '403s', 'wall time', 'req/s', 'limiter wait', 'rate limited', 'peak memory'
+    ))
+    for result in results:
+        click.echo(format_result(result))
+
+if __name__ == '__main__':
+    benchmark()
@@ -5,14 +5,23 @@ import importlib.util
 import importlib.machinery
 import os
 import sys
+import json
+import re
+import tempfile
+import sqlite3
 import time
+import timeit
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
 from unittest.mock import call, mock_open, patch
+import click
 from click.testing import CliRunner
 from io import StringIO
 
 
 def import_path(path):
-    module_name = os.path.basename(path).replace('-', '_')
+    module_name = os.path.splitext(os.path.basename(path))[0].replace('-', '_')
     spec = importlib.util.spec_from_loader(
         module_name,
         importlib.machinery.SourceFileLoader(module_name, path)
@@ -26,6 +35,54 @@ def import_path(path):
 dependabot = import_path('gh-dependabot')
 
 
+class FakeGitHubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def do_PUT(self):
+        self.respond()
+
+    def respond(self):
+        length = int(self.headers.get('Content-Length', 0))
+        body = self.rfile.read(length).decode('utf-8') if length else None
+        self.server.requests.append((self.command, self.path, dict(self.headers), body, self.client_address))
+
+        status, headers, response_body = self.server.responses.pop(0)
+        data = response_body.encode('utf-8')
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class FakeGitHubServer():
+    """A local stand-in for the GitHub API that replays canned responses"""
+
+    def __init__(self, responses):
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), FakeGitHubHandler)
+        self.server.requests = []
+        self.server.responses = list(responses)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def __enter__(self):
+        self.thread.start()
+        return self.server
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
 class TestDependabot(unittest.TestCase):
 
     # Uncomment the below line if you need to view the full diff of what is different in test behavior
@@ -65,30 +122,30 @@ class TestDependabot(unittest.TestCase):
                         },
                     ]
     parsed_alerts = [
-                        {
-                            'advisory_permalink': 'https://github.com/advisories/GHSA-6528-wvf6-f6qg',
-                            'created_at': '2022-08-10T18:44:52Z',
-                            'description': 'Its really dangerous ok',
-                            'dismiss_reason': None,
-                            'dismissed_at': None,
-                            'dismissed_by': None,
-                            'autodismissed_at': None,
-                            'fixed_at': None,
-                            'id': 'RVA_kwDOHzNV0M6pkdQi',
-                            'manifest_filepath': 'authn-service/requirements.txt',
-                            'package_ecosystem': 'PIP',
-                            'package_name': 'pycrypto',
-                            'package_version': '= 2.6.1',
-                            'repo': 'test',
-                            'severity': 'HIGH',
-                            'cvss_score': 9.8,
-                            'state': 'OPEN',
-                            'summary': 'Pycrypto generates weak key parameters',
-                            'vulnerable_versions': '<= 2.6.1'
-                        }
+                        dependabot.Alert(
+                            repo='test',
+                            id='RVA_kwDOHzNV0M6pkdQi',
+                            advisory_permalink='https://github.com/advisories/GHSA-6528-wvf6-f6qg',
+                            severity='HIGH',
+                            cvss_score=9.8,
+                            summary='Pycrypto generates weak key parameters',
+                            description='Its really dangerous ok',
+                            package_ecosystem='PIP',
+                            package_name='pycrypto',
+                            package_version='= 2.6.1',
+                            vulnerable_versions='<= 2.6.1',
+                            manifest_filepath='authn-service/requirements.txt',
+                            created_at='2022-08-10T18:44:52Z',
+                            state='OPEN',
+                            fixed_at=None,
+                            dismissed_at=None,
+                            dismiss_reason=None,
+                            dismissed_by=None,
+                            autodismissed_at=None
+                        )
                     ]
-    csv_header_values = 'advisory_permalink,created_at,description,dismiss_reason,dismissed_at,dismissed_by,autodismissed_at,fixed_at,id,manifest_filepath,package_ecosystem,package_name,package_version,repo,severity,cvss_score,state,summary,vulnerable_versions\r\n'
-    csv_row_values = 'https://github.com/advisories/GHSA-6528-wvf6-f6qg,2022-08-10T18:44:52Z,Its really dangerous ok,,,,,,RVA_kwDOHzNV0M6pkdQi,authn-service/requirements.txt,PIP,pycrypto,= 2.6.1,test,HIGH,9.8,OPEN,Pycrypto generates weak key parameters,<= 2.6.1\r\n'
+    csv_header_values = 'repo,id,advisory_permalink,severity,cvss_score,summary,description,package_ecosystem,package_name,package_version,vulnerable_versions,manifest_filepath,created_at,state,fixed_at,dismissed_at,dismiss_reason,dismissed_by,autodismissed_at\r\n'
+    csv_row_values = 'test,RVA_kwDOHzNV0M6pkdQi,https://github.com/advisories/GHSA-6528-wvf6-f6qg,HIGH,9.8,Pycrypto generates weak key parameters,Its really dangerous ok,PIP,pycrypto,= 2.6.1,<= 2.6.1,authn-service/requirements.txt,2022-08-10T18:44:52Z,OPEN,,,,,\r\n'
     gh_query = ['/opt/homebrew/bin/gh', 'api', 'graphql', '-F', 'org=github', '-F', 'repo=foo', '-F', 'cursor=null', '-f', 'query=\n    query ($org: String! $repo: String! $cursor: String){\n        repository(owner: $org name: $repo) {\n            name\n            vulnerabilityAlerts(first: 100 after: $cursor) {\n                pageInfo {\n                    hasNextPage\n                    endCursor\n                }\n                totalCount\n                nodes {\n                    id\n                    securityAdvisory {\n                        ...advFields\n                    }\n                    securityVulnerability {\n                        package {\n                            ...pkgFields\n                        }\n                        vulnerableVersionRange\n                        advisory {\n                            cvss {\n                                score\n                            }\n                        }\n                    }\n                    createdAt\n                    state\n                    fixedAt\n                    fixReason\n                    dismissedAt\n                    dismissReason\n                    dismisser {\n                        login\n                    }\n                    vulnerableManifestPath\n                    vulnerableRequirements\n                }\n            }\n        }\n    }\n    fragment advFields on SecurityAdvisory {\n        ghsaId\n        permalink\n        severity\n        description\n        summary\n    }\n    fragment pkgFields on SecurityAdvisoryPackage {\n        name\n        ecosystem\n    }\n    ']
     gh_paginated_query = ['/opt/homebrew/bin/gh', 'api', 'graphql', '-F', 'org=github', '-F', 'repo=foo', '-F', 'cursor=Y3Vyc29yOnYyOpHOr2XWzA==', '-f', 'query=\n    query ($org: String! $repo: String! $cursor: String){\n        repository(owner: $org name: $repo) {\n            name\n            vulnerabilityAlerts(first: 100 after: $cursor) {\n                pageInfo {\n                    hasNextPage\n                    endCursor\n                }\n                totalCount\n                nodes {\n                    id\n                    securityAdvisory {\n                        ...advFields\n                    }\n                    securityVulnerability {\n                        package {\n                            ...pkgFields\n                        }\n                        vulnerableVersionRange\n                        advisory {\n                            cvss {\n                                score\n                            }\n                        }\n                    }\n                    createdAt\n                    state\n                    fixedAt\n                    fixReason\n                    dismissedAt\n                    dismissReason\n                    dismisser {\n                        login\n                    }\n                    vulnerableManifestPath\n                    vulnerableRequirements\n                }\n            }\n        }\n    }\n    fragment advFields on SecurityAdvisory {\n        ghsaId\n        permalink\n        severity\n        description\n        summary\n    }\n    fragment pkgFields on SecurityAdvisoryPackage {\n        name\n        ecosystem\n    }\n    ']
 
@@ -96,7 +153,7 @@ class TestDependabot(unittest.TestCase):
 
     dependabot_enable_error_output = 'HTTP/2.0 404 Not Found\nAccess-Control-Allow-Origin: *\nAccess-Control-Expose-Headers: ETag, Link, Location, Retry-After, X-GitHub-OTP, X-RateLimit-Limit, X-RateLimit-Remaining, X-RateLimit-Used, X-RateLimit-Resource, X-RateLimit-Reset, X-OAuth-Scopes, X-Accepted-OAuth-Scopes, X-Poll-Interval, X-GitHub-Media-Type, X-GitHub-SSO, X-GitHub-Request-Id, Deprecation, Sunset\nContent-Security-Policy: default-src \'none\'\nDate: Tue, 01 Apr 1990 01:02:03 GMT\nGithub-Authentication-Token-Expiration: 2099-04-01 07:00:00 UTC\nReferrer-Policy: origin-when-cross-origin, strict-origin-when-cross-origin\nServer: GitHub.com\nStrict-Transport-Security: max-age=31536000; includeSubdomains; preload\nVary: Accept-Encoding, Accept, X-Requested-With\nX-Accepted-Oauth-Scopes: repo\nX-Content-Type-Options: nosniff\nX-Frame-Options: deny\nX-Github-Api-Version-Selected: 2022-08-09\nX-Github-Media-Type: github.v3; format=json\nX-Github-Request-Id: CCEE:9972:181CEB0:312E601:6345FB6B\nX-Oauth-Scopes: admin:gpg_key, admin:public_key, admin:ssh_signing_key, codespace, delete:packages, gist, project, read:org, repo, user, workflow, write:discussion, write:packages\nX-Ratelimit-Limit: 5000\nX-Ratelimit-Remaining: 4998\nX-Ratelimit-Reset: 1665534015\nX-Ratelimit-Resource: core\nX-Ratelimit-Used: 2\nX-Xss-Protection: 0\n\n{"message":"Not Found","documentation_url":"https://docs.github.com/rest"}'
 
-    dependabot_enable_parsed_headers = {'Access-Control-Allow-Origin': '*', 'Access-Control-Expose-Headers': 'ETag, Link, Location, Retry-After, X-GitHub-OTP, X-RateLimit-Limit, X-RateLimit-Remaining, X-RateLimit-Used, X-RateLimit-Resource, X-RateLimit-Reset, X-OAuth-Scopes, X-Accepted-OAuth-Scopes, X-Poll-Interval, X-GitHub-Media-Type, X-GitHub-SSO, X-GitHub-Request-Id, Deprecation, Sunset', 'Content-Security-Policy': "default-src 'none'", 'Date': 'Tue, 01 Apr 1990 01:02:03 GMT', 'Github-Authentication-Token-Expiration': '2099-04-01 07:00:00 UTC', 'Referrer-Policy': 'origin-when-cross-origin, strict-origin-when-cross-origin', 'Server': 'GitHub.com', 'Strict-Transport-Security': 'max-age=31536000; includeSubdomains; preload', 'Vary': 'Accept-Encoding, Accept, X-Requested-With', 'X-Accepted-Oauth-Scopes': 'repo', 'X-Content-Type-Options': 'nosniff', 'X-Frame-Options': 'deny', 'X-Github-Api-Version-Selected': '2022-08-09', 'X-Github-Media-Type': 'github.v3; format=json', 'X-Github-Request-Id': 'CCEE:9972:181CEB0:312E601:6345FB6B', 'X-Oauth-Scopes': 'admin:gpg_key, admin:public_key, admin:ssh_signing_key, codespace, delete:packages, gist, project, read:org, repo, user, workflow, write:discussion, write:packages', 'X-Ratelimit-Limit': '5000', 'X-Ratelimit-Remaining': '4998', 'X-Ratelimit-Reset': '1665534015', 'X-Ratelimit-Resource': 'core', 'X-Ratelimit-Used': '2'}
+    dependabot_enable_parsed_headers = {'Access-Control-Allow-Origin': '*', 'Access-Control-Expose-Headers': 'ETag, Link, Location, Retry-After, X-GitHub-OTP, X-RateLimit-Limit, X-RateLimit-Remaining, X-RateLimit-Used, X-RateLimit-Resource, X-RateLimit-Reset, X-OAuth-Scopes, X-Accepted-OAuth-Scopes, X-Poll-Interval, X-GitHub-Media-Type, X-GitHub-SSO, X-GitHub-Request-Id, Deprecation, Sunset', 'Content-Security-Policy': "default-src 'none'", 'Date': 'Tue, 01 Apr 1990 01:02:03 GMT', 'Github-Authentication-Token-Expiration': '2099-04-01 07:00:00 UTC', 'Referrer-Policy': 'origin-when-cross-origin, strict-origin-when-cross-origin', 'Server': 'GitHub.com', 'Strict-Transport-Security': 'max-age=31536000; includeSubdomains; preload', 'Vary': 'Accept-Encoding, Accept, X-Requested-With', 'X-Accepted-Oauth-Scopes': 'repo', 'X-Content-Type-Options': 'nosniff', 'X-Frame-Options': 'deny', 'X-Github-Api-Version-Selected': '2022-08-09', 'X-Github-Media-Type': 'github.v3; format=json', 'X-Github-Request-Id': 'CCEE:9972:181CEB0:312E601:6345FB6B', 'X-Oauth-Scopes': 'admin:gpg_key, admin:public_key, admin:ssh_signing_key, codespace, delete:packages, gist, project, read:org, repo, user, workflow, write:discussion, write:packages', 'X-Ratelimit-Limit': '5000', 'X-Ratelimit-Remaining': '4998', 'X-Ratelimit-Reset': '1665534015', 'X-Ratelimit-Resource': 'core', 'X-Ratelimit-Used': '2', 'X-Xss-Protection': '0'}
 
     dependabot_enable_success_parsed_output = ('204', dependabot_enable_parsed_headers, '')
 
@@ -128,47 +185,590 @@ class TestDependabot(unittest.TestCase):
         dependabot.generate_csv(self.parsed_alerts, None)
         self.assertEqual(fake_stdout.getvalue(), self.csv_header_values + self.csv_row_values)
 
+        fake_stdout.truncate(0)
+        fake_stdout.seek(0)
+        dependabot.generate_csv(self.parsed_alerts, None, ['severity', 'package_name'])
+        self.assertEqual(fake_stdout.getvalue(), 'severity,package_name\r\nHIGH,pycrypto\r\n')
+
+    def alerts_response(self, *repositories, errors=None):
+        data = {}
+        for index, repository in enumerate(repositories):
+            if repository is None:
+                data["repo%i" % index] = None
+                continue
+            nodes, end_cursor = repository
+            data["repo%i" % index] = {"vulnerabilityAlerts": {"pageInfo": {"hasNextPage": end_cursor is not None, "endCursor": end_cursor}, "nodes": nodes}}
+        results = {"data": data}
+        if errors:
+            results["errors"] = errors
+        return ('200', {}, json.dumps(results))
+
+    def test_build_alerts_query(self):
+        query = dependabot.build_alerts_query(2)
+        self.assertIn('query ($owner0: String! $name0: String! $cursor0: String $owner1: String! $name1: String! $cursor1: String)', query)
+        self.assertIn('repo0: repository(owner: $owner0 name: $name0)', query)
+        self.assertIn('repo1: repository(owner: $owner1 name: $name1)', query)
+        self.assertIn('vulnerabilityAlerts(first: 100 after: $cursor1)', query)
+        self.assertEqual(query.count('...alertConnectionFields'), 2)
+
     @patch("click.echo")
     @patch("gh_dependabot.call_gh_api")
-    @patch("gh_dependabot.parse_alerts")
-    def test_get_dependabot_alerts(self, fake_parse_alerts, fake_call_gh_api, fake_echo):
-        non_paginated_result = str(b'{"data":{"repository":{"name":"ghas-bootcamp","vulnerabilityAlerts":{"pageInfo":{"hasNextPage":false,"endCursor":"Y3Vyc29yOnYyOpHOr2XWzA=="},"totalCount":1,"nodes":[{"id":"RVA_kwDOHzNV0M6pkdQi","securityAdvisory":{"ghsaId":"GHSA-6528-wvf6-f6qg","permalink":"https://github.com/advisories/GHSA-6528-wvf6-f6qg","severity":"HIGH","description":"This so bad","summary":"Pycrypto generates weak key parameters"},"securityVulnerability":{"package":{"name":"pycrypto","ecosystem":"PIP"},"vulnerableVersionRange":"<= 2.6.1"},"createdAt":"2022-08-10T18:44:52Z","state":"OPEN","fixedAt":null,"fixReason":null,"dismissedAt":null,"dismissReason":null,"dismisser":null,"vulnerableManifestPath":"authn-service/requirements.txt","vulnerableRequirements":"= 2.6.1"}]}}}}', 'UTF-8')
-        fake_call_gh_api.return_value = ('200', [], non_paginated_result)
-        fake_parse_alerts.return_value = self.parsed_alerts
-        result = dependabot.get_dependabot_alerts('github/foo')
-        fake_parse_alerts.assert_called_once()
-        fake_call_gh_api.assert_called_once()
-        self.assertListEqual(result, self.parsed_alerts)
-
-        fake_call_gh_api.return_value = ('404', [], 'Something broke')
-        self.assertFalse(dependabot.get_dependabot_alerts('github/foo'))
-        fake_echo.assert_called()
+    def test_get_dependabot_alerts(self, fake_call_gh_api, fake_echo):
+        foo_alert = dict(self.graphql_alerts[0], id='foo')
+        bar_alert = dict(self.graphql_alerts[0], id='bar')
+        fake_call_gh_api.side_effect = [
+            self.alerts_response(([foo_alert], 'Y3Vyc29yOnYyOpHOr2XWzA=='), ([bar_alert], None)),
+            self.alerts_response(([foo_alert], None)),
+        ]
+        result = list(dependabot.get_dependabot_alerts(['github/foo', 'github/bar']))
+        self.assertListEqual([(alert.repo, alert.id) for alert in result], [('github/foo', 'foo'), ('github/foo', 'foo'), ('github/bar', 'bar')])
+
+        first_command, second_command = [ command.args[0] for command in fake_call_gh_api.call_args_list ]
+        self.assertListEqual(first_command[:9], ['graphql', '-f', 'owner0=github', '-f', 'name0=foo', '-f', 'owner1=github', '-f', 'name1=bar'])
+        self.assertEqual(first_command[9:11], ['-f', 'query=%s' % dependabot.build_alerts_query(2)])
+        # Only the repository with more pages is queried again
+        self.assertListEqual(second_command, ['graphql', '-f', 'owner0=github', '-f', 'name0=foo', '-f', 'cursor0=Y3Vyc29yOnYyOpHOr2XWzA==', '-f', 'query=%s' % dependabot.build_alerts_query(1)])
+        fake_echo.assert_not_called()
+
+        # The first page of the first repository comes out before the next page is requested
+        fake_call_gh_api.reset_mock()
+        fake_call_gh_api.side_effect = [
+            self.alerts_response(([foo_alert], 'Y3Vyc29yOnYyOpHOr2XWzA=='), ([bar_alert], None)),
+            self.alerts_response(([foo_alert], None)),
+        ]
+        result = dependabot.get_dependabot_alerts(['github/foo', 'github/bar'])
+        self.assertEqual(next(result).repo, 'github/foo')
+        self.assertEqual(fake_call_gh_api.call_count, 1)
+        self.assertEqual(len(list(result)), 2)
+
+        fake_call_gh_api.reset_mock()
+        fake_call_gh_api.side_effect = [('404', {}, 'Something broke')]
+        self.assertListEqual(list(dependabot.get_dependabot_alerts(['github/foo'])), [])
+        fake_echo.assert_any_call('ERROR: Could not get dependabot alerts for github/foo', err=True)
+
+        fake_echo.reset_mock()
+        fake_call_gh_api.side_effect = [self.alerts_response(None, ([bar_alert], None), errors=[{"type": "NOT_FOUND", "path": ["repo0"], "message": "Could not resolve to a Repository with the name 'github/missing'."}])]
+        result = list(dependabot.get_dependabot_alerts(['github/missing', 'github/bar']))
+        self.assertListEqual([alert.repo for alert in result], ['github/bar'])
+        fake_echo.assert_has_calls([call('ERROR: Could not get dependabot alerts for github/missing', err=True), call("Error Message: Could not resolve to a Repository with the name 'github/missing'.", err=True)])
+
+    @patch("gh_dependabot.call_gh_api")
+    def test_get_dependabot_alerts_bounds_buffer(self, fake_call_gh_api):
+        foo_alert = dict(self.graphql_alerts[0], id='foo')
+        bar_alert = dict(self.graphql_alerts[0], id='bar')
+        fake_call_gh_api.side_effect = [
+            self.alerts_response(([foo_alert], 'Y3Vyc29yOnYyOpHOr2XWzA=='), ([bar_alert, bar_alert], 'Y3Vyc29yOnYyOpHOr2XWzB==')),
+            self.alerts_response(([foo_alert], None)),
+            self.alerts_response(([bar_alert], None)),
+        ]
+        with patch.object(dependabot, 'MAX_BUFFERED_ALERTS', 2):
+            result = list(dependabot.get_dependabot_alerts(['github/foo', 'github/bar']))
 
-        fake_parse_alerts.reset_mock()
-        paginated_result = str(b'{"data":{"repository":{"name":"ghas-bootcamp","vulnerabilityAlerts":{"pageInfo":{"hasNextPage":true,"endCursor":"Y3Vyc29yOnYyOpHOr2XWzA=="},"totalCount":1,"nodes":[{"id":"RVA_kwDOHzNV0M6pkdQi","securityAdvisory":{"ghsaId":"GHSA-6528-wvf6-f6qg","permalink":"https://github.com/advisories/GHSA-6528-wvf6-f6qg","severity":"HIGH","description":"This so bad","summary":"Pycrypto generates weak key parameters"},"securityVulnerability":{"package":{"name":"pycrypto","ecosystem":"PIP"},"vulnerableVersionRange":"<= 2.6.1"},"createdAt":"2022-08-10T18:44:52Z","state":"OPEN","fixedAt":null,"fixReason":null,"dismissedAt":null,"dismissReason":null,"dismisser":null,"vulnerableManifestPath":"authn-service/requirements.txt","vulnerableRequirements":"= 2.6.1"}]}}}}', 'UTF-8')
-        fake_call_gh_api.side_effect = [('200', [], paginated_result), ('200', [], non_paginated_result)]
-        fake_parse_alerts.return_value = self.parsed_alerts
-        result = dependabot.get_dependabot_alerts('github/foo')
-        self.assertListEqual(result, self.parsed_alerts + self.parsed_alerts)
+        self.assertListEqual([ alert.id for alert in result ], ['foo', 'foo', 'bar', 'bar', 'bar'])
+        # Once bar's alerts fill the buffer, foo is paged on its own until it is done
+        self.assertListEqual([ call.args[0].count('-f') for call in fake_call_gh_api.call_args_list ], [5, 4, 4])
 
+    @patch("click.echo")
+    @patch("gh_dependabot.call_gh_api")
+    def test_get_dependabot_alerts_adapts_batch_size(self, fake_call_gh_api, fake_echo):
+        fake_call_gh_api.side_effect = [
+            self.alerts_response(errors=[{"type": "MAX_NODE_LIMIT_EXCEEDED", "message": "This query requests up to 1,000,000 possible nodes"}]),
+            ('502', {}, '{"message":"Something went wrong"}'),
+            self.alerts_response((self.graphql_alerts, None)),
+            self.alerts_response((self.graphql_alerts, None)),
+            self.alerts_response((self.graphql_alerts, None), (self.graphql_alerts, None)),
+        ]
+        result = list(dependabot.get_dependabot_alerts(['github/a', 'github/b', 'github/c', 'github/d'], dependabot.BatchSizer(4)))
+        self.assertListEqual([alert.repo for alert in result], ['github/a', 'github/b', 'github/c', 'github/d'])
+        commands = [ command.args[0] for command in fake_call_gh_api.call_args_list ]
+        self.assertListEqual([command.count('-f') - 1 for command in commands], [8, 4, 2, 2, 4])
+
+    def test_batch_sizer(self):
+        batch_sizer = dependabot.BatchSizer(8)
+        batch_sizer.shrink()
+        batch_sizer.shrink()
+        self.assertEqual(batch_sizer.size, 2)
+        batch_sizer.grow()
+        self.assertEqual(batch_sizer.size, 2)
+        batch_sizer.grow()
+        self.assertEqual(batch_sizer.size, 4)
+
+        self.assertEqual(dependabot.BatchSizer(100000).maximum, dependabot.GRAPHQL_NODE_LIMIT // (dependabot.ALERTS_PAGE_SIZE + 1))
+
+    @patch("gh_dependabot.generate_ndjson")
     @patch("gh_dependabot.generate_csv")
     @patch("gh_dependabot.get_dependabot_alerts")
-    def test_export(self, fake_get_dependabot_alerts, fake_generate_csv):
-        fake_get_dependabot_alerts.return_value = []
+    def test_export(self, fake_get_dependabot_alerts, fake_generate_csv, fake_generate_ndjson):
+        written = []
+        fake_generate_csv.side_effect = lambda data, filename, columns: written.append((list(data), filename))
+        fake_get_dependabot_alerts.return_value = iter([])
         runner = CliRunner()
         result = runner.invoke(dependabot.export, '-o test.csv github/foo'.split())
         # dependabot.export('github/foo', 'test.csv')
         self.assertEqual(0, result.exit_code)
-        fake_get_dependabot_alerts.assert_called_once_with('github/foo')
-        fake_generate_csv.assert_called_once_with([], 'test.csv')
+        fake_get_dependabot_alerts.assert_called_once()
+        self.assertListEqual(fake_get_dependabot_alerts.call_args.args[0], ['github/foo'])
+        self.assertEqual(fake_get_dependabot_alerts.call_args.args[1].maximum, 50)
+        self.assertListEqual(written, [([], 'test.csv')])
 
+        written.clear()
         fake_get_dependabot_alerts.reset_mock()
-        fake_get_dependabot_alerts.side_effect = [['first,repo,results'], ['second,repo,results']]
-        fake_generate_csv.reset_mock()
-        result = runner.invoke(dependabot.export, '-o test.csv github/foo github/bar'.split())
+        fake_get_dependabot_alerts.side_effect = lambda batch, batch_sizer, **kwargs: iter(['%s,results' % name for name in batch])
+        result = runner.invoke(dependabot.export, '-o test.csv -b 2 github/foo github/bar github/baz'.split())
+        self.assertEqual(0, result.exit_code)
+        self.assertListEqual(sorted(command.args[0] for command in fake_get_dependabot_alerts.call_args_list), [['github/baz'], ['github/foo', 'github/bar']])
+        self.assertListEqual(written, [(['github/foo,results', 'github/bar,results', 'github/baz,results'], 'test.csv')])
+
+        fake_generate_ndjson.side_effect = lambda data, filename, columns: written.append((list(data), filename))
+        written.clear()
+        result = runner.invoke(dependabot.export, '-f ndjson github/foo'.split())
         self.assertEqual(0, result.exit_code)
-        fake_get_dependabot_alerts.assert_has_calls([call('github/foo'), call('github/bar')])
-        fake_generate_csv.assert_called_once_with(['first,repo,results', 'second,repo,results'], 'test.csv')
+        self.assertListEqual(written, [(['github/foo,results'], None)])
+
+    def graphql_alert(self, alert_id, created_at, state='OPEN'):
+        return dict(self.graphql_alerts[0], id=alert_id, createdAt=created_at, state=state)
+
+    def newest_first_response(self, *repositories):
+        data = {}
+        for index, (nodes, start_cursor, archived) in enumerate(repositories):
+            data["repo%i" % index] = {"isArchived": archived, "vulnerabilityAlerts": {"pageInfo": {"hasPreviousPage": start_cursor is not None, "startCursor": start_cursor}, "nodes": nodes}}
+        return ('200', {}, json.dumps({"data": data}))
+
+    def test_alert_cache(self):
+        cache = dependabot.AlertCache(':memory:')
+        first, second = dependabot.parse_alerts('github/foo', [self.graphql_alert('a1', '2022-01-01T00:00:00Z'), self.graphql_alert('a2', '2022-02-01T00:00:00Z', 'FIXED')])
+        cache.save_alert(second)
+        cache.save_alert(first)
+        self.assertDictEqual(cache.get_newest_alert_times(['github/foo']), {})
+
+        cache.mark_synced(['github/foo', 'github/bar'], synced_at=100)
+        self.assertDictEqual(cache.get_newest_alert_times(['github/foo', 'github/bar', 'github/baz']), {'github/foo': '2022-02-01T00:00:00Z', 'github/bar': None})
+        self.assertListEqual(cache.get_open_alerts(['github/foo']), [('github/foo', 'a1')])
+        self.assertListEqual(cache.get_alert_ids(['github/foo']), [('github/foo', 'a1'), ('github/foo', 'a2')])
+        self.assertListEqual(list(cache.get_alerts(['github/foo'])), [first, second])
+        self.assertListEqual(cache.get_status(), [('github/bar', 100, 0, 0), ('github/foo', 100, 2, 1)])
+
+        cache.delete_alert('github/foo', 'a1')
+        self.assertListEqual(list(cache.get_alerts(['github/foo'])), [second])
+
+        cache.mark_synced(['github/bar'])
+        self.assertListEqual(cache.prune(24 * 60 * 60), ['github/foo'])
+        self.assertListEqual(list(cache.get_alerts(['github/foo'])), [])
+        self.assertListEqual([row[0] for row in cache.get_status()], ['github/bar'])
+        cache.close()
+
+    @patch("click.echo")
+    @patch("gh_dependabot.call_gh_api")
+    def test_sync_alert_cache(self, fake_call_gh_api, fake_echo):
+        cache = dependabot.AlertCache(':memory:')
+        a0 = self.graphql_alert('a0', '2021-12-01T00:00:00Z')
+        a1 = self.graphql_alert('a1', '2022-01-01T00:00:00Z')
+        a2 = self.graphql_alert('a2', '2022-02-01T00:00:00Z')
+        a3 = self.graphql_alert('a3', '2022-03-01T00:00:00Z')
+
+        fake_call_gh_api.side_effect = [self.newest_first_response(([a0, a1, a2], None, False), ([a1], None, True))]
+        self.assertListEqual(dependabot.sync_alert_cache(cache, ['github/foo', 'github/bar'], dependabot.BatchSizer(), 2), ['github/foo'])
+        self.assertIn('vulnerabilityAlerts(last: 100 before: $cursor0)', fake_call_gh_api.call_args.args[0][-1])
+        self.assertListEqual([alert.id for alert in cache.get_alerts(['github/foo', 'github/bar'])], ['a0', 'a1', 'a2'])
+        self.assertListEqual([row[0] for row in cache.get_status()], ['github/foo'])
+        fake_echo.assert_any_call('Skipping archived repository github/bar', err=True)
+
+        # Paging stops at the newest cached alert and the other open ones are re-read to catch fixes and deletions
+        fake_call_gh_api.reset_mock()
+        fake_call_gh_api.side_effect = [
+            self.newest_first_response(([a2, a3], 'Y3Vyc29yOnYyOpHOr2XWzA==', False)),
+            ('200', {}, json.dumps({"data": {"n0": [dict(a0, state='FIXED', fixedAt='2022-04-01T00:00:00Z'), None]}})),
+        ]
+        self.assertListEqual(dependabot.sync_alert_cache(cache, ['github/foo'], dependabot.BatchSizer(), 2), ['github/foo'])
+        self.assertEqual(fake_call_gh_api.call_count, 2)
+        # a2 and a3 came in with the new page, so they aren't read a second time
+        refresh_query = fake_call_gh_api.call_args.args[0][-1]
+        self.assertIn('n0: nodes(ids: ["a0", "a1"])', refresh_query)
+        self.assertListEqual([(alert.id, alert.state) for alert in cache.get_alerts(['github/foo'])], [('a0', 'FIXED'), ('a2', 'OPEN'), ('a3', 'OPEN')])
+
+        # A full refresh re-reads the closed alerts too, in case they were reopened
+        fake_call_gh_api.reset_mock()
+        fake_call_gh_api.side_effect = [
+            self.newest_first_response(([a3], 'Y3Vyc29yOnYyOpHOr2XWzA==', False)),
+            ('200', {}, json.dumps({"data": {"n0": [a0, a2]}})),
+        ]
+        self.assertListEqual(dependabot.sync_alert_cache(cache, ['github/foo'], dependabot.BatchSizer(), 2, full_refresh=True), ['github/foo'])
+        self.assertIn('n0: nodes(ids: ["a0", "a2"])', fake_call_gh_api.call_args.args[0][-1])
+        self.assertListEqual([(alert.id, alert.state) for alert in cache.get_alerts(['github/foo'])], [('a0', 'OPEN'), ('a2', 'OPEN'), ('a3', 'OPEN')])
+
+        # Deleted repositories are evicted
+        fake_call_gh_api.side_effect = [('200', {}, json.dumps({"data": {"repo0": None}, "errors": [{"type": "NOT_FOUND", "path": ["repo0"], "message": "Could not resolve to a Repository"}]}))]
+        self.assertListEqual(dependabot.sync_alert_cache(cache, ['github/foo'], dependabot.BatchSizer(), 2), [])
+        self.assertListEqual(cache.get_status(), [])
+        cache.close()
+
+    @patch("gh_dependabot.call_gh_api")
+    def test_refresh_dependabot_alerts(self, fake_call_gh_api):
+        cached = [ ('github/foo', 'a%03i' % index) for index in range(250) ]
+        alert = self.graphql_alert('a000', '2022-01-01T00:00:00Z')
+        fake_call_gh_api.side_effect = [
+            ('502', {}, ''),
+            ('200', {}, json.dumps({"data": {"n0": [alert] * 99 + [None]}})),
+            ('200', {}, json.dumps({"data": {"n0": [alert] * 100}})),
+            ('200', {}, json.dumps({"data": {"n0": [alert] * 50}})),
+        ]
+        result = list(dependabot.refresh_dependabot_alerts(cached, dependabot.BatchSizer(2)))
+
+        self.assertEqual(len(result), 250)
+        self.assertEqual(result[99], ('github/foo', 'a099', None))
+        self.assertEqual(result[100][2].id, 'a000')
+        # Many ids go into one query as aliased nodes fields, halving them when the query is too expensive
+        queries = [ call.args[0][-1] for call in fake_call_gh_api.call_args_list ]
+        self.assertListEqual([ query.count(': nodes(ids:') for query in queries ], [2, 1, 1, 1])
+        self.assertIn('n1: nodes(ids: ["a100", ', queries[0])
+
+    @patch("gh_dependabot.call_gh_api")
+    def test_sync_alert_cache_streams_repositories(self, fake_call_gh_api):
+        fake_call_gh_api.side_effect = lambda command: self.newest_first_response(([], None, False))
+        fetched_before = {}
+
+        def listing():
+            for repo_name in ['github/foo', 'github/bar', 'github/baz']:
+                fetched_before[repo_name] = fake_call_gh_api.call_count
+                yield repo_name
+
+        cache = dependabot.AlertCache(':memory:')
+        self.assertListEqual(dependabot.sync_alert_cache(cache, listing(), dependabot.BatchSizer(1), 1), ['github/foo', 'github/bar', 'github/baz'])
+        # The first repositories are fetched while the rest are still being listed
+        self.assertGreater(fetched_before['github/baz'], 0)
+        self.assertEqual(fake_call_gh_api.call_count, 3)
+        cache.close()
+
+    @patch("click.echo")
+    @patch("gh_dependabot.generate_csv")
+    def test_export_org_listing_fails(self, fake_generate_csv, fake_echo):
+        fake_generate_csv.side_effect = lambda data, filename, columns: list(data)
+        with patch("gh_dependabot.call_gh_api", return_value=('502', {}, '')):
+            result = CliRunner().invoke(dependabot.export, ['--org', 'github'])
+        self.assertEqual(1, result.exit_code)
+        self.assertIn('Error: Could not list repositories for github', result.output)
+
+    @patch("click.echo")
+    def test_export_fails_on_unreadable_repositories(self, fake_echo):
+        with tempfile.TemporaryDirectory() as directory, patch("gh_dependabot.call_gh_api", return_value=('502', {}, '')):
+            output = os.path.join(directory, 'alerts.csv')
+            result = CliRunner().invoke(dependabot.export, ['-o', output, 'github/foo', 'github/bar'])
+            self.assertEqual(1, result.exit_code)
+            self.assertIn('Error: Could not get dependabot alerts for github/foo, github/bar', result.output)
+            # The report is still written, with everything that could be read
+            with open(output) as output_file:
+                self.assertEqual(len(output_file.readlines()), 1)
+
+    @patch("click.echo")
+    @patch("gh_dependabot.call_gh_api")
+    def test_sync_alert_cache_failed_partway(self, fake_call_gh_api, fake_echo):
+        cache = dependabot.AlertCache(':memory:')
+        alerts = [ self.graphql_alert('a00%i' % index, '2022-0%i-01T00:00:00Z' % (index + 1)) for index in range(5) ]
+        cache.save_alert(dependabot.parse_alerts('github/foo', alerts[:1])[0])
+        cache.mark_synced(['github/foo'])
+
+        # The newest alerts come in, then the next page fails
+        fake_call_gh_api.side_effect = [self.newest_first_response((alerts[3:], 'Y3Vyc29yOnYyOpHOr2XWzA==', False)), ('502', {}, '')]
+        self.assertListEqual(dependabot.sync_alert_cache(cache, ['github/foo'], dependabot.BatchSizer(), 2), ['github/foo'])
+        self.assertDictEqual(cache.get_newest_alert_times(['github/foo']), {'github/foo': '2022-01-01T00:00:00Z'})
+
+        # So the next sync still pages back to the alerts that were missed
+        fake_call_gh_api.reset_mock()
+        fake_call_gh_api.side_effect = [
+            self.newest_first_response((alerts[3:], 'Y3Vyc29yOnYyOpHOr2XWzA==', False)),
+            self.newest_first_response((alerts[:3], 'Y3Vyc29yOnYyOpHOr2XWzB==', False)),
+        ]
+        dependabot.sync_alert_cache(cache, ['github/foo'], dependabot.BatchSizer(), 2)
+        # Every cached alert came in again with the pages, so none of them is re-read by id
+        self.assertEqual(fake_call_gh_api.call_count, 2)
+        self.assertListEqual([ alert.id for alert in cache.get_alerts(['github/foo']) ], ['a000', 'a001', 'a002', 'a003', 'a004'])
+        self.assertDictEqual(cache.get_newest_alert_times(['github/foo']), {'github/foo': '2022-05-01T00:00:00Z'})
+        cache.close()
+
+    def test_alert_cache_migrates_high_water_mark(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'alerts.db')
+            connection = sqlite3.connect(path)
+            connection.executescript("""
+                CREATE TABLE repos (repo TEXT PRIMARY KEY, synced_at REAL NOT NULL);
+                CREATE TABLE alerts (repo TEXT NOT NULL, id TEXT NOT NULL, state TEXT, created_at TEXT, record TEXT NOT NULL, PRIMARY KEY (repo, id));
+                INSERT INTO repos VALUES ('github/foo', 100);
+                INSERT INTO alerts VALUES ('github/foo', 'a1', 'OPEN', '2022-01-01T00:00:00Z', '{}');
+            """)
+            connection.commit()
+            connection.close()
+
+            cache = dependabot.AlertCache(path)
+            self.assertDictEqual(cache.get_newest_alert_times(['github/foo']), {'github/foo': '2022-01-01T00:00:00Z'})
+            cache.close()
+
+    @patch("click.echo")
+    @patch("gh_dependabot.generate_csv")
+    @patch("gh_dependabot.sync_alert_cache")
+    def test_export_incremental(self, fake_sync_alert_cache, fake_generate_csv, fake_echo):
+        written = []
+        fake_generate_csv.side_effect = lambda data, filename, columns: written.append(list(data))
+        synced = []
+        full_refreshes = []
+        fake_sync_alert_cache.side_effect = lambda cache, repo_names, batch_sizer, workers, skipped, full_refresh: full_refreshes.append(full_refresh) or synced.extend(repo_names) or ['github/foo']
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, 'cache', 'alerts.db')
+            cache = dependabot.AlertCache(cache_path)
+            cache.save_alert(self.parsed_alerts[0]._replace(repo='github/foo'))
+            cache.commit()
+            cache.close()
+
+            result = CliRunner().invoke(dependabot.export, ['--incremental', '--cache-path', cache_path, 'github/foo', 'github/bar'])
+            self.assertEqual(0, result.exit_code)
+            self.assertListEqual(synced, ['github/foo', 'github/bar'])
+            self.assertListEqual(written, [[self.parsed_alerts[0]._replace(repo='github/foo')]])
+
+            # --full-refresh implies --incremental
+            result = CliRunner().invoke(dependabot.export, ['--full-refresh', '--cache-path', cache_path, 'github/foo'])
+            self.assertEqual(0, result.exit_code)
+            self.assertListEqual(full_refreshes, [False, True])
+
+    def test_cache_commands(self):
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as directory:
+            cache_path = os.path.join(directory, 'alerts.db')
+            result = runner.invoke(dependabot.cache_status, ['--cache-path', cache_path])
+            self.assertEqual(result.output, 'No alert cache found at %s\n' % cache_path)
+
+            cache = dependabot.AlertCache(cache_path)
+            cache.save_alert(self.parsed_alerts[0]._replace(repo='github/foo'))
+            cache.mark_synced(['github/foo'], synced_at=time.time() - 3 * 24 * 60 * 60 - 60)
+            cache.mark_synced(['github/bar'], synced_at=time.time() - 90)
+            cache.commit()
+            cache.close()
+
+            result = runner.invoke(dependabot.cache_status, ['--cache-path', cache_path])
+            self.assertEqual(result.output, '2 repositories in %s\ngithub/foo  synced 3d 0h ago  1 alerts (1 open)\ngithub/bar  synced 1m 30s ago  0 alerts (0 open)\n' % cache_path)
+
+            result = runner.invoke(dependabot.cache_prune, ['--older-than', '2', '--cache-path', cache_path])
+            self.assertEqual(result.output, 'Evicted 1 repositories from the cache\ngithub/foo\n')
+
+    @patch("time.sleep")
+    @patch("gh_dependabot.get_transport")
+    def test_export_keeps_stdout_clean(self, fake_get_transport, fake_sleep):
+        fake_get_transport.return_value.request.side_effect = [
+            ('403', {'Retry-After': '1'}, '{"message":"You have exceeded a secondary rate limit"}'),
+            self.alerts_response((self.graphql_alerts, None), None),
+        ]
+        result = CliRunner(mix_stderr=False).invoke(dependabot.export, ['-f', 'ndjson', 'github/foo', 'github/missing'])
+        self.assertEqual(1, result.exit_code)
+        self.assertListEqual([ json.loads(line)['repo'] for line in result.stdout.splitlines() ], ['github/foo'])
+        self.assertIn('GitHub secondary rate limit hit. Sleeping for 6 seconds', result.stderr)
+        self.assertIn('ERROR: Could not get dependabot alerts for github/missing', result.stderr)
+        self.assertIn('Error: Could not get dependabot alerts for github/missing', result.stderr)
+
+    @patch("sys.stdout", new_callable=StringIO)
+    def test_generate_ndjson(self, fake_stdout):
+        dependabot.generate_ndjson(iter(self.parsed_alerts + self.parsed_alerts), None)
+        lines = fake_stdout.getvalue().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertDictEqual(json.loads(lines[0]), self.parsed_alerts[0]._asdict())
+
+    def test_stream_in_order(self):
+        def repeat(number):
+            for _ in range(number):
+                yield number
+
+        self.assertListEqual(list(dependabot.stream_in_order(repeat, [3, 1, 2], 2)), [3, 3, 3, 1, 2, 2])
+
+        produced = []
+        def count_up(number):
+            for value in range(1000):
+                produced.append(value)
+                yield value
+
+        results = dependabot.stream_in_order(count_up, [1, 2, 3], 3, buffer_size=10)
+        self.assertEqual(next(results), 0)
+        time.sleep(0.2)
+        # Workers stop producing once their buffer is full instead of running ahead
+        self.assertLessEqual(len(produced), 40)
+        results.close()
+
+        def broken(number):
+            yield number
+            raise ValueError('boom')
+
+        with self.assertRaises(ValueError):
+            list(dependabot.stream_in_order(broken, [1, 2], 2))
+
+    def org_repositories_response(self, repositories, end_cursor=None):
+        nodes = [ {"nameWithOwner": name, "isArchived": False, "visibility": visibility, "languages": {"nodes": [{"name": language} for language in languages]}, "repositoryTopics": {"nodes": [{"topic": {"name": topic}} for topic in topics]}} for name, visibility, languages, topics in repositories ]
+        return ('200', {}, json.dumps({"data": {"organization": {"repositories": {"pageInfo": {"hasNextPage": end_cursor is not None, "endCursor": end_cursor}, "nodes": nodes}}}}))
+
+    @patch("click.echo")
+    @patch("gh_dependabot.call_gh_api")
+    def test_list_org_repositories(self, fake_call_gh_api, fake_echo):
+        fake_call_gh_api.side_effect = [
+            self.org_repositories_response([('github/foo', 'PUBLIC', ['Python'], ['security']), ('github/bar', 'PRIVATE', ['JavaScript', 'TypeScript'], [])], 'Y3Vyc29yOnYyOpHOr2XWzA=='),
+            self.org_repositories_response([('github/baz', 'INTERNAL', ['TypeScript'], ['security'])]),
+        ]
+        repositories = dependabot.list_org_repositories('github')
+        self.assertEqual(next(repositories), 'github/foo')
+        # Later pages are only listed once the earlier ones have been used up
+        self.assertEqual(fake_call_gh_api.call_count, 1)
+        self.assertListEqual(list(repositories), ['github/bar', 'github/baz'])
+
+        first_command, second_command = [ command.args[0] for command in fake_call_gh_api.call_args_list ]
+        self.assertListEqual(first_command[:5], ['graphql', '-f', 'org=github', '-F', 'isArchived=false'])
+        self.assertListEqual(second_command[:7], ['graphql', '-f', 'org=github', '-F', 'isArchived=false', '-f', 'cursor=Y3Vyc29yOnYyOpHOr2XWzA=='])
+
+        fake_call_gh_api.reset_mock()
+        fake_call_gh_api.side_effect = [
+            self.org_repositories_response([('github/foo', 'PUBLIC', ['Python'], ['security']), ('github/bar', 'PRIVATE', ['JavaScript', 'TypeScript'], [])], 'Y3Vyc29yOnYyOpHOr2XWzA=='),
+            self.org_repositories_response([('github/baz', 'INTERNAL', ['TypeScript'], ['security'])]),
+        ]
+        self.assertListEqual(list(dependabot.list_org_repositories('github', languages=['typescript'], visibilities=['internal', 'private'], archived='include')), ['github/bar', 'github/baz'])
+        self.assertNotIn('-F', fake_call_gh_api.call_args.args[0])
+
+        fake_call_gh_api.side_effect = [self.org_repositories_response([('github/foo', 'PUBLIC', ['Python'], ['security']), ('github/bar', 'PRIVATE', [], [])])]
+        self.assertListEqual(list(dependabot.list_org_repositories('github', topics=['Security'], archived='only')), ['github/foo'])
+        self.assertIn('isArchived=true', fake_call_gh_api.call_args.args[0])
+
+        fake_call_gh_api.side_effect = [('200', {}, json.dumps({"data": {"organization": None}}))]
+        with self.assertRaisesRegex(click.ClickException, 'Could not list repositories for missing'):
+            list(dependabot.list_org_repositories('missing'))
+
+        # A page failing partway through must not pass for the end of the list
+        fake_call_gh_api.side_effect = [
+            self.org_repositories_response([('github/foo', 'PUBLIC', [], [])], 'Y3Vyc29yOnYyOpHOr2XWzA=='),
+            ('502', {}, ''),
+        ]
+        repositories = dependabot.list_org_repositories('github')
+        self.assertEqual(next(repositories), 'github/foo')
+        self.assertRaises(click.ClickException, next, repositories)
+
+    @patch("click.echo")
+    @patch("gh_dependabot.generate_csv")
+    @patch("gh_dependabot.get_dependabot_alerts")
+    @patch("gh_dependabot.list_org_repositories")
+    def test_export_org(self, fake_list_org_repositories, fake_get_dependabot_alerts, fake_generate_csv, fake_echo):
+        written = []
+        fake_generate_csv.side_effect = lambda data, filename, columns: written.append(list(data))
+        fake_list_org_repositories.return_value = iter(['github/bar', 'github/baz'])
+        fake_get_dependabot_alerts.side_effect = lambda batch, batch_sizer, **kwargs: iter(['%s,results' % name for name in batch])
+        result = CliRunner().invoke(dependabot.export, '-o test.csv --org github --language Python --topic security --visibility public --archived include github/foo'.split())
+        self.assertEqual(0, result.exit_code)
+        fake_list_org_repositories.assert_called_once_with('github', ('Python',), ('security',), ('public',), 'include')
+        self.assertListEqual(written, [['github/foo,results', 'github/bar,results', 'github/baz,results']])
+        fake_echo.assert_has_calls([call('Exporting dependabot alerts from github/bar into test.csv', err=False), call('Exporting dependabot alerts from github/baz into test.csv', err=False)])
+
+        # Repositories named explicitly that the org listing returns again are only exported once
+        written.clear()
+        fake_list_org_repositories.return_value = iter(['github/foo', 'github/bar'])
+        result = CliRunner().invoke(dependabot.export, '-o test.csv -b 1 --org github github/foo github/bar github/foo'.split())
+        self.assertEqual(0, result.exit_code)
+        self.assertListEqual(written, [['github/foo,results', 'github/bar,results']])
+
+    @patch("click.echo")
+    @patch("gh_dependabot.get_alerts_enabled", return_value={})
+    @patch("gh_dependabot.print_result")
+    @patch("gh_dependabot.enable_feature")
+    @patch("gh_dependabot.list_org_repositories")
+    def test_enable_org(self, fake_list_org_repositories, fake_enable_feature, fake_print_result, fake_get_alerts_enabled, fake_echo):
+        fake_list_org_repositories.return_value = iter(['github/foo', 'github/bar'])
+        fake_enable_feature.return_value = True
+        runner = CliRunner()
+        result = runner.invoke(dependabot.enable, '-a --org github'.split())
+        self.assertEqual(0, result.exit_code)
+        fake_list_org_repositories.assert_called_once_with('github', (), (), (), 'exclude')
+        fake_print_result.assert_has_calls([call('alerts', ['github/foo', 'github/bar'], 'repositories', True), call('alerts', [], 'repositories', False)])
+
+        fake_list_org_repositories.return_value = iter(['github/foo', 'github/bar'])
+        fake_print_result.reset_mock()
+        result = runner.invoke(dependabot.enable, '-a --org github github/bar'.split())
+        self.assertEqual(0, result.exit_code)
+        fake_print_result.assert_has_calls([call('alerts', ['github/bar', 'github/foo'], 'repositories', True)])
+
+        result = runner.invoke(dependabot.enable, '-ao --org github'.split())
+        self.assertEqual(2, result.exit_code)
+
+    def test_build_alert_fragments(self):
+        fragments = dependabot.build_alert_fragments(['repo', 'severity', 'dismissed_by'])
+        self.assertIn("""    fragment alertFields on RepositoryVulnerabilityAlert {
+        id
+        securityAdvisory {
+            severity
+        }
+        dismisser {
+            login
+        }
+    }""", fragments)
+        self.assertNotIn('description', fragments)
+
+        fragments = dependabot.build_alert_fragments()
+        for field in ['description', 'permalink', 'score', 'ecosystem', 'vulnerableRequirements', 'autoDismissedAt']:
+            self.assertIn(field, fragments)
+
+        query = dependabot.build_alerts_query(1, columns=['severity'], states=['OPEN', 'DISMISSED'])
+        self.assertIn('vulnerabilityAlerts(first: 100 after: $cursor0 states: [OPEN, DISMISSED])', query)
+        self.assertNotIn('summary', query)
+
+    def test_parse_alerts_columns(self):
+        self.assertListEqual(dependabot.parse_alerts('test', self.graphql_alerts, ['package_name', 'repo', 'cvss_score']), [dependabot.Alert(package_name='pycrypto', repo='test', cvss_score=9.8)])
+        dismissed = dict(self.graphql_alerts[0], dismisser={'login': 'octocat'})
+        self.assertListEqual(dependabot.parse_alerts('test', [dismissed], ['dismissed_by']), [dependabot.Alert(dismissed_by={'login': 'octocat'})])
+
+    def test_filter_alerts(self):
+        alerts = [
+            dependabot.Alert(state='OPEN', severity='HIGH', package_ecosystem='PIP'),
+            dependabot.Alert(state='FIXED', severity='CRITICAL', package_ecosystem='NPM'),
+            dependabot.Alert(state='OPEN', severity='LOW', package_ecosystem='NPM'),
+        ]
+        self.assertIs(dependabot.filter_alerts(alerts), alerts)
+        self.assertListEqual(list(dependabot.filter_alerts(alerts, severities=['HIGH', 'CRITICAL'])), alerts[:2])
+        self.assertListEqual(list(dependabot.filter_alerts(alerts, states=['OPEN'], ecosystems=['NPM'])), alerts[2:])
+
+    @patch("click.echo")
+    @patch("gh_dependabot.get_dependabot_alerts")
+    def test_export_filters(self, fake_get_dependabot_alerts, fake_echo):
+        fetched = []
+        def fake_alerts(batch, batch_sizer, skipped, columns, states):
+            fetched.append((columns, states))
+            return iter([
+                dependabot.Alert(repo=batch[0], package_name='pycrypto', severity='HIGH'),
+                dependabot.Alert(repo=batch[0], package_name='lodash', severity='LOW'),
+            ])
+        fake_get_dependabot_alerts.side_effect = fake_alerts
+
+        runner = CliRunner()
+        result = runner.invoke(dependabot.export, '--state open --severity high,CRITICAL --columns repo,package_name github/foo'.split())
+        self.assertEqual(0, result.exit_code)
+        self.assertListEqual(fetched, [(['repo', 'package_name', 'severity'], ['OPEN'])])
+        self.assertListEqual(result.stdout.splitlines(), ['repo,package_name', 'github/foo,pycrypto'])
+
+        result = runner.invoke(dependabot.export, '--severity urgent github/foo'.split())
+        self.assertEqual(2, result.exit_code)
+        result = runner.invoke(dependabot.export, '--columns repo,bogus github/foo'.split())
+        self.assertEqual(2, result.exit_code)
+
+    def test_chunk(self):
+        self.assertListEqual(list(dependabot.chunk(iter(range(5)), 2)), [[0, 1], [2, 3], [4]])
+        self.assertListEqual(list(dependabot.chunk([], 2)), [])
+
+    def test_run_in_order(self):
+        def slow_square(number):
+            # Earlier items finish last so the results only come back in order if they are reordered
+            time.sleep((10 - number) * 0.005)
+            return number * number
+
+        self.assertListEqual(list(dependabot.run_in_order(slow_square, range(10), 4)), [number * number for number in range(10)])
+
+        pulled = []
+        def items():
+            for number in range(100):
+                pulled.append(number)
+                yield number
+
+        results = dependabot.run_in_order(lambda number: number, items(), 2)
+        self.assertEqual(next(results), 0)
+        # Only a small window of items is read ahead of the results
+        self.assertLessEqual(len(pulled), 5)
+        results.close()
 
     def test_parse_api_output(self):
         expected_success_result = ('204', self.dependabot_enable_parsed_headers, '')
@@ -179,12 +779,85 @@ class TestDependabot(unittest.TestCase):
         result = dependabot.parse_api_output(self.dependabot_enable_error_output)
         self.assertTupleEqual(expected_fail_result, result)
 
+    def legacy_parse_api_output(self, output):
+        # parse_api_output as it was before the single pass rewrite, kept to benchmark against
+        api_output_regex = re.compile(r'HTTP/\d\.\d (\d+) (?:\w[\w\s]+)\n(.+?)(?:\n|\r\n){2}([^\n]+)?\n?', re.DOTALL)
+        header_regex = re.compile(r'([\w-]+):\s?(.+?)\r?\n')
+        response_code, headers, body = api_output_regex.findall(output)[0]
+        return (response_code, { item[0]: item[1] for item in header_regex.findall(headers) }, body)
+
+    def legacy_parse_alerts(self, repo_name, data):
+        # parse_alerts as it was when alerts were dicts, copied as is to benchmark against
+        alerts = []
+
+        for alert in data:
+            # click.echo(alert)
+            parsed_alert = {}
+            parsed_alert["repo"] = repo_name
+            parsed_alert["id"] = alert["id"]
+            parsed_alert["advisory_permalink"] = alert["securityAdvisory"]["permalink"]
+            parsed_alert["severity"] = alert["securityAdvisory"]["severity"]
+            parsed_alert["cvss_score"] = alert["securityVulnerability"]["advisory"]["cvss"]["score"]
+            parsed_alert["summary"] = alert["securityAdvisory"]["summary"]
+            parsed_alert["description"] = alert["securityAdvisory"]["description"]
+            parsed_alert["package_ecosystem"] = alert["securityVulnerability"]["package"]["ecosystem"]
+            parsed_alert["package_name"] = alert["securityVulnerability"]["package"]["name"]
+            parsed_alert["package_version"] = alert["vulnerableRequirements"]
+            parsed_alert["vulnerable_versions"] = alert["securityVulnerability"]["vulnerableVersionRange"]
+            parsed_alert["manifest_filepath"] = alert["vulnerableManifestPath"]
+            parsed_alert["created_at"] = alert["createdAt"]
+            parsed_alert["state"] = alert["state"]
+            parsed_alert["fixed_at"] = alert["fixedAt"]
+            parsed_alert["dismissed_at"] = alert["dismissedAt"]
+            parsed_alert["dismiss_reason"] = alert["dismissReason"]
+            parsed_alert["dismissed_by"] = alert["dismisser"]
+            parsed_alert["autodismissed_at"] = alert["autoDismissedAt"]
+
+            alerts.append(parsed_alert)
+
+        return alerts
+
+    def benchmark_output(self):
+        body = self.alerts_response((self.graphql_alerts * 100, None))[2]
+        return self.dependabot_enable_error_output.rsplit('\n', 1)[0] + '\n' + body + '\n', body
+
+    def test_parse_api_output_matches_legacy(self):
+        output, body = self.benchmark_output()
+        self.assertEqual(dependabot.parse_api_output(output)[2], body)
+        self.assertEqual(self.legacy_parse_api_output(output)[2], body)
+
+    def test_parse_alerts_matches_legacy(self):
+        data = self.graphql_alerts * 100
+        self.assertListEqual([alert._asdict() for alert in dependabot.parse_alerts('test', data)], self.legacy_parse_alerts('test', data))
+
+        legacy_size = sys.getsizeof(self.legacy_parse_alerts('test', data)[0])
+        self.assertLess(sys.getsizeof(dependabot.parse_alerts('test', data)[0]) * 2, legacy_size)
+
+    # Wall clock comparisons depend on the machine, so they only run when asked for
+    @unittest.skipUnless(os.environ.get('GH_DEPENDABOT_BENCHMARKS'), 'set GH_DEPENDABOT_BENCHMARKS=1 to run timing benchmarks')
+    def test_parse_api_output_benchmark(self):
+        output = self.benchmark_output()[0]
+        legacy = min(timeit.repeat(lambda: self.legacy_parse_api_output(output), number=200, repeat=5))
+        current = min(timeit.repeat(lambda: dependabot.parse_api_output(output), number=200, repeat=5))
+        self.assertLess(current, legacy)
+
+    @unittest.skipUnless(os.environ.get('GH_DEPENDABOT_BENCHMARKS'), 'set GH_DEPENDABOT_BENCHMARKS=1 to run timing benchmarks')
+    def test_parse_alerts_benchmark(self):
+        data = self.graphql_alerts * 100
+        legacy = min(timeit.repeat(lambda: self.legacy_parse_alerts('test', data), number=50, repeat=5))
+        current = min(timeit.repeat(lambda: dependabot.parse_alerts('test', data), number=50, repeat=5))
+        self.assertLess(current, legacy)
+
     @patch("shutil.which")
     @patch("time.sleep")
     @patch("click.echo")
     @patch("gh_dependabot.parse_api_output")
     @patch("subprocess.run")
     def test_call_gh_api(self, fake_subprocess_run, fake_parse_api_output, fake_echo, fake_sleep, fake_which):
+        for patcher in [patch.object(dependabot, 'transport', dependabot.GhCliTransport()), patch.object(dependabot, 'limiter')]:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
         fake_which.return_value = '/opt/homebrew/bin/gh'
         fake_subprocess_run.return_value = self.MockSubprocess(self.dependabot_enable_success_output)
         fake_parse_api_output.return_value = self.dependabot_enable_success_parsed_output
@@ -203,14 +876,16 @@ class TestDependabot(unittest.TestCase):
         fake_parse_api_output.reset_mock()
         current_time = int(time.time())
         patched_headers = self.dependabot_enable_parsed_headers.copy()
-        patched_headers['X-Ratelimit-Reset'] = current_time + 10
+        patched_headers['X-Ratelimit-Reset'] = current_time + 9
         patched_headers['X-Ratelimit-Remaining'] = '0'
         fake_api_primary_rate_limit_parsed_output = ('403', patched_headers, '{"message":"API rate limit exceeded for xxx.xxx.xxx.xxx.","documentation_url":"https://docs.github.com/rest/overview/resources-in-the-rest-api#rate-limiting"}')
         fake_parse_api_output.side_effect = [fake_api_primary_rate_limit_parsed_output, self.dependabot_enable_success_parsed_output]
-        result = dependabot.call_gh_api(self.dependabot_repo_enable_command)
+        with patch("time.time", return_value=current_time):
+            result = dependabot.call_gh_api(self.dependabot_repo_enable_command)
         self.assertTupleEqual(result, self.dependabot_enable_success_parsed_output)
         fake_sleep.assert_called_once_with(14)
-        fake_echo.assert_called_once_with('GitHub primary rate limit hit. Sleeping for 14 seconds')
+        fake_echo.assert_called_once_with('GitHub primary rate limit hit. Sleeping for 14 seconds', err=True)
+        dependabot.limiter.pause.assert_called_once_with(14, 'core')
 
         fake_parse_api_output.reset_mock()
         fake_sleep.reset_mock()
@@ -225,7 +900,7 @@ class TestDependabot(unittest.TestCase):
         self.assertTupleEqual(result, self.dependabot_enable_success_parsed_output)
         fake_parse_api_output.assert_called_with(self.dependabot_enable_success_output)
         fake_sleep.assert_called_once_with(10)
-        fake_echo.assert_called_once_with('GitHub secondary rate limit hit. Sleeping for 10 seconds')
+        fake_echo.assert_called_once_with('GitHub secondary rate limit hit. Sleeping for 10 seconds', err=True)
 
         fake_parse_api_output.reset_mock()
         fake_sleep.reset_mock()
@@ -236,7 +911,179 @@ class TestDependabot(unittest.TestCase):
         self.assertTupleEqual(result, self.dependabot_enable_success_parsed_output)
         fake_parse_api_output.assert_called_with(self.dependabot_enable_success_output)
         fake_sleep.assert_called_once_with(60)
-        fake_echo.assert_called_once_with('GitHub secondary rate limit hit. Sleeping for 60 seconds')
+        fake_echo.assert_called_once_with('GitHub secondary rate limit hit. Sleeping for 60 seconds', err=True)
+
+    @patch("time.sleep")
+    def test_adaptive_rate_limiter(self, fake_sleep):
+        limiter = dependabot.AdaptiveRateLimiter(min_intervals={'core': 0.1}, max_interval=1.0, reserve=10)
+        reset = str(int(time.time()) + 1000)
+
+        # Plenty of budget left speeds requests up towards the minimum interval
+        for _ in range(10):
+            limiter.update({'X-Ratelimit-Limit': '5000', 'X-Ratelimit-Remaining': '4000', 'X-Ratelimit-Reset': reset, 'X-Ratelimit-Resource': 'core'})
+        self.assertAlmostEqual(limiter.intervals['core'], 0.1, places=2)
+
+        # A low budget spreads the remaining requests out until the reset
+        for _ in range(10):
+            limiter.update({'X-Ratelimit-Limit': '5000', 'X-Ratelimit-Remaining': '1010', 'X-Ratelimit-Reset': reset, 'X-Ratelimit-Resource': 'core'})
+        self.assertAlmostEqual(limiter.intervals['core'], 1.0, places=1)
+        self.assertNotIn('graphql', limiter.intervals)
+
+        limiter.acquire('core')
+        limiter.acquire('core')
+        self.assertAlmostEqual(fake_sleep.call_args.args[0], 1.0, places=1)
+
+        # Stop before the last few requests are used up instead of running into a 403, but only for that resource
+        fake_sleep.reset_mock()
+        limiter.update({'X-Ratelimit-Limit': '5000', 'X-Ratelimit-Remaining': '5', 'X-Ratelimit-Reset': reset})
+        self.assertGreater(limiter.acquire('core'), 990)
+        self.assertLess(limiter.acquire('graphql'), 1.5)
+
+        fake_sleep.reset_mock()
+        limiter = dependabot.AdaptiveRateLimiter(min_intervals={'core': 0}, write_interval=1.0)
+        limiter.intervals['core'] = 0
+        limiter.acquire('core', write=True)
+        self.assertAlmostEqual(limiter.acquire('core', write=True), 1.0, places=1)
+        limiter.pause(60, 'core')
+        self.assertLess(limiter.acquire('graphql'), 1.5)
+        limiter.pause(30)
+        self.assertAlmostEqual(limiter.acquire('graphql'), 30, places=0)
+        self.assertAlmostEqual(limiter.acquire('core', write=True), 60, places=0)
+
+    def test_adaptive_rate_limiter_floor(self):
+        limiter = dependabot.AdaptiveRateLimiter()
+        reset = str(int(time.time()) + 3600)
+        for _ in range(20):
+            for resource in ('core', 'graphql', 'search'):
+                limiter.update({'X-Ratelimit-Limit': '5000', 'X-Ratelimit-Remaining': '5000', 'X-Ratelimit-Reset': reset, 'X-Ratelimit-Resource': resource})
+
+        # Even with the whole budget left REST reads stay under the secondary limit of 900 a minute
+        self.assertGreaterEqual(limiter.intervals['core'], 0.067)
+        self.assertLessEqual(60 / limiter.intervals['core'], 900)
+        self.assertAlmostEqual(limiter.intervals['graphql'], 0.05, places=3)
+        self.assertGreaterEqual(limiter.intervals['search'], 0.067)
+
+    def test_parse_gh_api_args(self):
+        self.assertTupleEqual(dependabot.parse_gh_api_args(self.dependabot_repo_enable_command), ('PUT', '/repos/foo/bar/vulnerability-alerts', {'Accept': 'application/vnd.github+json'}, None))
+
+        command = ['graphql', '-F', 'org=github', '-f', 'repo=123', '-F', 'cursor=null', '-F', 'first=100', '-f', 'query=query { viewer { login } }']
+        expected_payload = {'query': 'query { viewer { login } }', 'variables': {'org': 'github', 'repo': '123', 'cursor': None, 'first': 100}}
+        self.assertTupleEqual(dependabot.parse_gh_api_args(command), ('POST', '/graphql', {}, expected_payload))
+
+        self.assertTupleEqual(dependabot.parse_gh_api_args(['repos/foo/bar']), ('GET', '/repos/foo/bar', {}, None))
+
+    def test_http_transport(self):
+        responses = [
+            (204, {'X-RateLimit-Remaining': '4998', 'X-RateLimit-Reset': '1665534015'}, ''),
+            (200, {'Content-Type': 'application/json'}, '{"data":{"viewer":{"login":"octocat"}}}'),
+            (404, {}, '{"message":"Not Found"}'),
+        ]
+        with FakeGitHubServer(responses) as server:
+            transport = dependabot.HttpTransport('secret', base_url=server_url(server))
+
+            result = transport.request(self.dependabot_repo_enable_command)
+            self.assertEqual(result.status, '204')
+            self.assertEqual(result.body, '')
+            self.assertEqual(result.headers['X-Ratelimit-Remaining'], '4998')
+            self.assertEqual(result.headers['X-Ratelimit-Reset'], '1665534015')
+
+            result = transport.request(['graphql', '-F', 'org=github', '-f', 'query=query { viewer { login } }'])
+            self.assertEqual(result.status, '200')
+            self.assertEqual(json.loads(result.body), {'data': {'viewer': {'login': 'octocat'}}})
+
+            result = transport.request(['/repos/foo/missing'])
+            self.assertEqual(result.status, '404')
+            transport.close()
+
+        method, path, headers, body, _ = server.requests[0]
+        self.assertEqual((method, path, body), ('PUT', '/repos/foo/bar/vulnerability-alerts', None))
+        self.assertEqual(headers['Authorization'], 'token secret')
+        self.assertEqual(headers['Accept'], 'application/vnd.github+json')
+
+        method, path, headers, body, _ = server.requests[1]
+        self.assertEqual((method, path), ('POST', '/graphql'))
+        self.assertEqual(json.loads(body), {'query': 'query { viewer { login } }', 'variables': {'org': 'github'}})
+
+        # Every request should have reused the same keep-alive connection
+        self.assertEqual(len({request[4] for request in server.requests}), 1)
+
+    @patch("time.sleep")
+    @patch("gh_dependabot.create_transport")
+    def test_metrics(self, fake_create_transport, fake_sleep):
+        responses = [
+            (403, {'Retry-After': '0'}, '{"message":"You have exceeded a secondary rate limit"}'),
+            (204, {'X-RateLimit-Remaining': '4998', 'X-RateLimit-Reset': str(int(time.time()) + 3600), 'X-RateLimit-Resource': 'core'}, ''),
+        ]
+        with FakeGitHubServer(responses) as server, tempfile.TemporaryDirectory() as directory, \
+                patch.object(dependabot, 'metrics'), patch.object(dependabot, 'transport'):
+            fake_create_transport.return_value = dependabot.HttpTransport('secret', base_url=server_url(server))
+            trace_path = os.path.join(directory, 'trace.jsonl')
+            result = CliRunner().invoke(dependabot.dependabot, ['--trace', trace_path, 'enable', '-a', '--no-precheck', 'github/foo'])
+            fake_create_transport.return_value.close()
+
+            self.assertEqual(0, result.exit_code, result.output)
+            with open(trace_path) as trace_file:
+                records = [ json.loads(line) for line in trace_file ]
+
+        self.assertEqual(len(records), 2)
+        limited, record = records
+        self.assertEqual((limited['endpoint'], limited['status'], limited['attempt'], limited['rate_limit_sleep']), ('/repos/github/foo/vulnerability-alerts', 403, 0, 5))
+        self.assertEqual((record['method'], record['endpoint'], record['status']), ('PUT', '/repos/github/foo/vulnerability-alerts', 204))
+        self.assertEqual((record['attempt'], record['rate_limit_sleep'], record['bytes']), (1, 0, 0))
+        self.assertEqual((record['resource'], record['remaining']), ('core', 4998))
+        self.assertGreater(record['latency'], 0)
+
+        summary = result.output.splitlines()
+        self.assertIn('Requests             2', summary)
+        self.assertIn('Rate limit retries   1', summary)
+        self.assertIn('Rate limit sleep     5.0s', summary)
+        self.assertIn('Lowest core quota    4998', summary)
+
+    def test_percentile(self):
+        self.assertEqual(dependabot.percentile([], 50), 0.0)
+        self.assertEqual(dependabot.percentile([0.5], 99), 0.5)
+        values = [ index / 100 for index in range(1, 101) ]
+        self.assertEqual(dependabot.percentile(values, 50), 0.5)
+        self.assertEqual(dependabot.percentile(values, 99), 0.99)
+
+    @patch("gh_dependabot.create_transport")
+    def test_get_transport_is_created_once(self, fake_create_transport):
+        def slow_transport(name):
+            time.sleep(0.05)
+            return object()
+        fake_create_transport.side_effect = slow_transport
+
+        with patch.object(dependabot, 'transport', None):
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                transports = list(executor.map(lambda _: dependabot.get_transport(), range(4)))
+
+        self.assertEqual(fake_create_transport.call_count, 1)
+        self.assertEqual(len({ id(transport) for transport in transports }), 1)
+
+    def test_http_transport_reconnects(self):
+        responses = [
+            (200, {'Connection': 'close'}, '{}'),
+            (200, {}, '{}'),
+        ]
+        with FakeGitHubServer(responses) as server:
+            transport = dependabot.HttpTransport('secret', base_url=server_url(server) + '/api/v3')
+            self.assertEqual(transport.request(['/repos/foo/bar']).status, '200')
+            self.assertEqual(transport.request(['graphql', '-f', 'query=query { viewer { login } }']).status, '200')
+            transport.close()
+
+        self.assertEqual([request[1] for request in server.requests], ['/api/v3/repos/foo/bar', '/api/graphql'])
+        self.assertEqual(len({request[4] for request in server.requests}), 2)
+
+    @patch("click.echo")
+    @patch("gh_dependabot.get_gh_token")
+    def test_create_transport(self, fake_get_gh_token, fake_echo):
+        fake_get_gh_token.return_value = 'secret'
+        self.assertIsInstance(dependabot.create_transport('http'), dependabot.HttpTransport)
+        self.assertIsInstance(dependabot.create_transport('gh'), dependabot.GhCliTransport)
+
+        fake_get_gh_token.return_value = None
+        self.assertIsInstance(dependabot.create_transport('http'), dependabot.GhCliTransport)
+        fake_echo.assert_called_once()
 
     @patch("click.echo")
     @patch("gh_dependabot.call_gh_api")
@@ -257,23 +1104,116 @@ class TestDependabot(unittest.TestCase):
         fake_echo.assert_called()
 
     @patch("click.echo")
+    @patch("gh_dependabot.is_security_updates_enabled", return_value=False)
+    @patch("gh_dependabot.get_alerts_enabled", return_value={})
     @patch("gh_dependabot.print_result")
     @patch("gh_dependabot.enable_feature")
-    def test_enable(self, fake_enable_feature, fake_print_result, fake_echo):
-        fake_enable_feature.side_effect = [True, False]
+    def test_enable(self, fake_enable_feature, fake_print_result, fake_get_alerts_enabled, fake_is_security_updates_enabled, fake_echo):
+        fake_enable_feature.side_effect = lambda name, organization, feature: name == 'github/foo'
         runner = CliRunner()
         runner.invoke(dependabot.enable, '-a github/foo github/bar'.split())
-        fake_echo.assert_has_calls([call('Enabling dependabot alerts for github/foo'), call('Enabling dependabot alerts for github/bar')])
+        fake_echo.assert_has_calls([call('Enabling dependabot alerts for github/foo'), call('Enabling dependabot alerts for github/bar')], any_order=True)
         fake_print_result.assert_has_calls([call('alerts', ['github/foo'], 'repositories', True), call('alerts', ['github/bar'], 'repositories', False)])
 
         fake_echo.reset_mock()
         fake_print_result.reset_mock()
         fake_enable_feature.reset_mock()
-        fake_enable_feature.side_effect = [True, False]
         runner.invoke(dependabot.enable, '-s github/foo github/bar'.split())
-        fake_echo.assert_has_calls([call('Enabling dependabot security updates for github/foo'), call('Enabling dependabot security updates for github/bar')])
+        fake_echo.assert_has_calls([call('Enabling dependabot security updates for github/foo'), call('Enabling dependabot security updates for github/bar')], any_order=True)
         fake_print_result.assert_has_calls([call('security updates', ['github/foo'], 'repositories', True), call('security updates', ['github/bar'], 'repositories', False)])
 
+        fake_print_result.reset_mock()
+        fake_enable_feature.side_effect = lambda name, organization, feature: name in ('github/b', 'github/d')
+        runner.invoke(dependabot.enable, '-a -w 4 github/a github/b github/c github/d github/e'.split())
+        fake_print_result.assert_has_calls([call('alerts', ['github/b', 'github/d'], 'repositories', True), call('alerts', ['github/a', 'github/c', 'github/e'], 'repositories', False)])
+
+    @patch("click.echo")
+    @patch("gh_dependabot.is_security_updates_enabled")
+    @patch("gh_dependabot.get_alerts_enabled")
+    @patch("gh_dependabot.print_result")
+    @patch("gh_dependabot.enable_feature")
+    def test_enable_precheck(self, fake_enable_feature, fake_print_result, fake_get_alerts_enabled, fake_is_security_updates_enabled, fake_echo):
+        fake_enable_feature.return_value = True
+        fake_get_alerts_enabled.side_effect = lambda names: { name: name == 'github/foo' for name in names }
+        fake_is_security_updates_enabled.side_effect = lambda name: name == 'github/bar'
+        runner = CliRunner()
+        result = runner.invoke(dependabot.enable, '-as github/foo github/bar'.split())
+        self.assertEqual(0, result.exit_code)
+        fake_get_alerts_enabled.assert_called_once_with(['github/foo', 'github/bar'])
+        fake_enable_feature.assert_has_calls([call('github/bar', False, 'alerts'), call('github/foo', False, 'security')], any_order=True)
+        self.assertEqual(fake_enable_feature.call_count, 2)
+        fake_print_result.assert_has_calls([call('alerts', ['github/bar'], 'repositories', True), call('alerts', [], 'repositories', False), call('security updates', ['github/foo'], 'repositories', True), call('security updates', [], 'repositories', False)])
+        fake_echo.assert_any_call('Skipped 1 repositories that already had dependabot alerts enabled')
+        fake_echo.assert_any_call('Skipped 1 repositories that already had dependabot security updates enabled')
+
+        # Organizations and --no-precheck go straight to enabling
+        fake_enable_feature.reset_mock()
+        fake_get_alerts_enabled.reset_mock()
+        runner.invoke(dependabot.enable, '-a --no-precheck github/foo github/bar'.split())
+        runner.invoke(dependabot.enable, '-ao foo'.split())
+        fake_get_alerts_enabled.assert_not_called()
+        self.assertEqual(fake_enable_feature.call_count, 3)
+
+    @patch("click.echo")
+    @patch("gh_dependabot.get_alerts_enabled", return_value={})
+    @patch("gh_dependabot.print_result")
+    @patch("gh_dependabot.enable_feature")
+    def test_enable_journal(self, fake_enable_feature, fake_print_result, fake_get_alerts_enabled, fake_echo):
+        fake_enable_feature.side_effect = lambda name, organization, feature: name != 'github/bar'
+        runner = CliRunner()
+        with tempfile.TemporaryDirectory() as directory:
+            journal_path = os.path.join(directory, 'enable.journal')
+            result = runner.invoke(dependabot.enable, ['-a', '-j', journal_path, 'github/foo', 'github/bar'])
+            self.assertEqual(0, result.exit_code)
+            with open(journal_path) as journal:
+                entries = [ json.loads(line) for line in journal ]
+            self.assertListEqual(entries, [{'name': 'github/foo', 'feature': 'alerts', 'result': 'enabled'}, {'name': 'github/bar', 'feature': 'alerts', 'result': 'failed'}])
+
+            # Simulate a run that was killed half way through writing a line
+            with open(journal_path, 'a') as journal:
+                journal.write('{"name": "github/baz", "feat')
+
+            fake_enable_feature.reset_mock()
+            fake_enable_feature.side_effect = None
+            fake_enable_feature.return_value = True
+            result = runner.invoke(dependabot.enable, ['-a', '-j', journal_path, '--resume', 'github/foo', 'github/bar', 'github/baz'])
+            self.assertEqual(0, result.exit_code)
+            self.assertListEqual(sorted(command.args[0] for command in fake_enable_feature.call_args_list), ['github/bar', 'github/baz'])
+            fake_get_alerts_enabled.assert_called_with(['github/bar', 'github/baz'])
+            fake_echo.assert_any_call('Skipped 1 repositories the journal already had dependabot alerts enabled for')
+            self.assertSetEqual(dependabot.read_journal(journal_path), {('alerts', 'github/foo'), ('alerts', 'github/bar'), ('alerts', 'github/baz')})
+
+        result = runner.invoke(dependabot.enable, ['-a', '--resume', 'github/foo'])
+        self.assertEqual(2, result.exit_code)
+
+    @patch("click.echo")
+    @patch("gh_dependabot.call_gh_api")
+    def test_get_alerts_enabled(self, fake_call_gh_api, fake_echo):
+        fake_call_gh_api.return_value = ('200', {}, json.dumps({"data": {"repo0": {"hasVulnerabilityAlertsEnabled": True}, "repo1": {"hasVulnerabilityAlertsEnabled": None}, "repo2": None}}))
+        self.assertDictEqual(dependabot.get_alerts_enabled(['github/foo', 'github/bar', 'github/baz']), {'github/foo': True, 'github/bar': False, 'github/baz': False})
+        command = fake_call_gh_api.call_args.args[0]
+        self.assertListEqual(command[:5], ['graphql', '-f', 'owner0=github', '-f', 'name0=foo'])
+        self.assertIn('repo2: repository(owner: $owner2 name: $name2)', command[-1])
+
+        fake_call_gh_api.reset_mock()
+        self.assertDictEqual(dependabot.get_alerts_enabled([]), {})
+        fake_call_gh_api.assert_not_called()
+
+        fake_call_gh_api.return_value = ('502', {}, 'Bad gateway')
+        self.assertDictEqual(dependabot.get_alerts_enabled(['github/foo']), {})
+        fake_echo.assert_called_once()
+
+    @patch("gh_dependabot.call_gh_api")
+    def test_is_security_updates_enabled(self, fake_call_gh_api):
+        fake_call_gh_api.return_value = ('200', {}, '{"enabled":true,"paused":false}')
+        self.assertTrue(dependabot.is_security_updates_enabled('foo/bar'))
+        fake_call_gh_api.assert_called_once_with(['--method', 'GET', '-H', 'Accept: application/vnd.github+json', '/repos/foo/bar/automated-security-fixes'])
+
+        fake_call_gh_api.return_value = ('200', {}, '{"enabled":false,"paused":false}')
+        self.assertFalse(dependabot.is_security_updates_enabled('foo/bar'))
+        fake_call_gh_api.return_value = ('404', {}, '{"message":"Not Found"}')
+        self.assertFalse(dependabot.is_security_updates_enabled('foo/bar'))
+
     @patch("click.echo")
     def test_print_result(self, fake_echo):
         dependabot.print_result('alerts', ['github/foo'], 'repositories', True)
@@ -283,5 +1223,27 @@ class TestDependabot(unittest.TestCase):
         dependabot.print_result('alerts', ['github/bar'], 'repositories', False)
         fake_echo.assert_has_calls([call('Unable to enable dependabot alerts for 1 repositories'), call('List of unsuccessful repositories:'), call('github/bar')])
 
+    def test_benchmark(self):
+        # The benchmark imports its own copy of the extension, so keep the one every other test patches
+        with patch.dict(sys.modules):
+            benchmark = import_path('gh-dependabot_benchmark.py')
+
+        result = CliRunner().invoke(benchmark.benchmark, '--repos 3 --alerts 120 --page-size 50 --latency 0 --secondary-limit-every 4 --sleep-scale 0 --no-memory --json export enable'.split())
+        self.assertEqual(0, result.exit_code, result.output)
+        export, enable = [ json.loads(line) for line in result.output.splitlines() ]
+
+        self.assertEqual(export['alerts'], 360)
+        # One request for the org's repositories and three pages of alerts, one of them retried after a 403
+        self.assertEqual((export['requests'], export['graphql'], export['rate_limited']), (5, 5, 1))
+        # Which requests get the 403s depends on the workers, but the repository listing, the precheck,
+        # three security update checks and six writes all get through in the end
+        self.assertGreater(enable['rate_limited'], 0)
+        self.assertEqual(enable['requests'] - enable['rate_limited'], 2 + 3 + 6)
+        self.assertIsNone(export['peak_memory'])
+
+
+def server_url(server):
+    return 'http://127.0.0.1:%i' % server.server_address[1]
+
 if __name__ == '__main__':
     unittest.main()